@@ -5,14 +5,20 @@ Generates a CSV with item descriptions, total quantities, and average values.
 """
 import argparse
 import csv
+import functools
 import os
+import re
 import sys
-import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from array import array
 from collections import defaultdict
 from datetime import datetime
+from io import BytesIO
 from typing import Dict, List, Optional, Set, Tuple
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from lxml import etree
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,14 +28,91 @@ USER_ID = os.getenv("MYDATA_USER_ID")
 API_KEY = os.getenv("MYDATA_API_KEY")
 API_BASE_URL = "https://mydatapi.aade.gr/myDATA/RequestDocs"
 
+# myDATA XML namespace and precomputed Clark-notation tags, so element
+# lookups skip the per-call prefix/namespace-dict resolution
+NS_URI = "http://www.aade.gr/myDATA/invoice/v1.0"
+TAG_INVOICE = f"{{{NS_URI}}}invoice"
+TAG_CONTINUATION_TOKEN = f"{{{NS_URI}}}continuationToken"
+TAG_NEXT_PARTITION_KEY = f"{{{NS_URI}}}nextPartitionKey"
+TAG_NEXT_ROW_KEY = f"{{{NS_URI}}}nextRowKey"
+TAG_ISSUER = f"{{{NS_URI}}}issuer"
+TAG_VAT_NUMBER = f"{{{NS_URI}}}vatNumber"
+TAG_NAME = f"{{{NS_URI}}}name"
+TAG_INVOICE_DETAILS = f"{{{NS_URI}}}invoiceDetails"
+TAG_ITEM_DESCR = f"{{{NS_URI}}}itemDescr"
+TAG_QUANTITY = f"{{{NS_URI}}}quantity"
+TAG_NET_VALUE = f"{{{NS_URI}}}netValue"
+
+
 if not USER_ID or not API_KEY:
     print("Error: MYDATA_USER_ID and MYDATA_API_KEY environment variables must be set", file=sys.stderr)
     print("Please create a .env file with your credentials (see .env.example)", file=sys.stderr)
     sys.exit(1)
 
+# Shared session so paginated requests reuse pooled TCP/TLS connections and
+# transient failures are retried inside urllib3; auth headers are set once
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=3))
+SESSION.headers.update({
+    "aade-user-id": USER_ID,
+    "Ocp-Apim-Subscription-Key": API_KEY,
+    # myDATA pages are large, highly compressible XML; brotli/gzip cut the
+    # bytes on the wire by 5-10x
+    "Accept-Encoding": "br, gzip, deflate",
+})
+
+
+def _to_float(text: Optional[str], default: Optional[float] = None, _float=float) -> Optional[float]:
+    """
+    Parse a numeric XML payload, returning default when text is missing or invalid.
+    float() already tolerates surrounding whitespace, so no strip() is needed;
+    the builtin is bound as a default arg to keep the lookup local in the hot loop.
+    """
+    if not text:
+        return default
+    try:
+        return _float(text)
+    except ValueError:
+        return default
+
+
+# Cheap pre-scan for pagination tokens so the next page request can be issued
+# before the current page is fully parsed (the parser remains authoritative)
+_NEXT_PARTITION_KEY_RE = re.compile(rb"<(?:\w+:)?nextPartitionKey>([^<]+)</")
+_NEXT_ROW_KEY_RE = re.compile(rb"<(?:\w+:)?nextRowKey>([^<]+)</")
+
+# Entity and numeric character references that may appear inside a token;
+# the peek must undo them exactly as the parser would, or an escaped token
+# (legal in Azure Table keys) would be sent back to the API verbatim
+_XML_REF_RE = re.compile(r"&(?:#(\d+)|#x([0-9a-fA-F]+)|(amp|lt|gt|apos|quot));")
+_XML_NAMED_REFS = {"amp": "&", "lt": "<", "gt": ">", "apos": "'", "quot": '"'}
+
+
+def _unescape_xml(text: str) -> str:
+    """Resolve predefined XML entities and character references."""
+    return _XML_REF_RE.sub(
+        lambda m: chr(int(m[1])) if m[1] else (chr(int(m[2], 16)) if m[2] else _XML_NAMED_REFS[m[3]]),
+        text,
+    )
+
+
+
+def _peek_continuation(xml_content: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """Scan the raw XML for continuation tokens without parsing it."""
+    npk = _NEXT_PARTITION_KEY_RE.search(xml_content)
+    nrk = _NEXT_ROW_KEY_RE.search(xml_content)
+    return (
+        _unescape_xml(npk.group(1).decode('utf-8')) if npk else None,
+        _unescape_xml(nrk.group(1).decode('utf-8')) if nrk else None,
+    )
 
+
+@functools.lru_cache(maxsize=32)
 def convert_date_to_api_format(date_str: str) -> str:
-    """Convert date from YYYY-MM-DD to DD/MM/YYYY format for API."""
+    """
+    Convert date from YYYY-MM-DD to DD/MM/YYYY format for API.
+    Cached: the same two bounds are re-converted on every paginated request.
+    """
     date_obj = datetime.strptime(date_str, "%Y-%m-%d")
     return date_obj.strftime("%d/%m/%Y")
 
@@ -39,7 +122,7 @@ def fetch_invoices(
     date_to: str,
     next_partition_key: Optional[str] = None,
     next_row_key: Optional[str] = None
-) -> str:
+) -> bytes:
     """
     Fetch invoices from myDATA API.
 
@@ -50,7 +133,7 @@ def fetch_invoices(
         next_row_key: Pagination key for next row
 
     Returns:
-        XML response as string
+        Raw XML response bytes
     """
     api_date_from = convert_date_to_api_format(date_from)
     api_date_to = convert_date_to_api_format(date_to)
@@ -66,131 +149,129 @@ def fetch_invoices(
     if next_row_key:
         params["nextRowKey"] = next_row_key
 
-    headers = {
-        "aade-user-id": USER_ID,
-        "Ocp-Apim-Subscription-Key": API_KEY
-    }
-
     try:
-        response = requests.get(API_BASE_URL, params=params, headers=headers, timeout=30)
+        response = SESSION.get(API_BASE_URL, params=params, timeout=30)
         response.raise_for_status()
-        return response.text
+        # Raw bytes: lxml reads the XML encoding declaration itself, so the
+        # full-body str decode response.text would do is never needed
+        return response.content
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data: {e}", file=sys.stderr)
         if hasattr(e, 'response') and e.response is not None:
             print(f"Response text: {e.response.text}", file=sys.stderr)
-        return ""
+        return b""
 
 
-def parse_invoice_items(xml_content: str) -> Tuple[List[Dict], Set[Tuple[str, str]], Optional[str], Optional[str]]:
+def parse_invoice_items(xml_content: bytes) -> Tuple[List[str], array, array, Set[Tuple[str, str]], Optional[str], Optional[str]]:
     """
     Parse XML response and extract invoice line items.
 
+    Line items are returned as three parallel columns (description, quantity,
+    net value) instead of one dict per item; the numeric columns are
+    array('d') so values are stored as unboxed C doubles.
+
     Args:
-        xml_content: XML response as string
+        xml_content: Raw XML response bytes
 
     Returns:
-        Tuple of (list of item records, set of (vat, name) for issuers without items,
+        Tuple of (descriptions, quantities, net values,
+                  set of (vat, name) for issuers without items,
                   next_partition_key, next_row_key)
     """
     if not xml_content:
-        return [], set(), None, None
-
-    try:
-        root = ET.fromstring(xml_content)
-    except ET.ParseError as e:
-        print(f"Error parsing XML: {e}", file=sys.stderr)
-        return [], set(), None, None
-
-    ns = {'ns': 'http://www.aade.gr/myDATA/invoice/v1.0'}
+        return [], array('d'), array('d'), set(), None, None
 
-    # Extract pagination tokens
+    # Pagination tokens
     next_partition_key = None
     next_row_key = None
 
-    continuation_token = root.find("ns:continuationToken", ns)
-    if continuation_token is not None:
-        npk = continuation_token.find("ns:nextPartitionKey", ns)
-        nrk = continuation_token.find("ns:nextRowKey", ns)
-        if npk is not None:
-            next_partition_key = npk.text
-        if nrk is not None:
-            next_row_key = nrk.text
-
-    items = []
+    descrs: List[str] = []
+    qtys = array('d')
+    nets = array('d')
     issuers_without_items: Set[Tuple[str, str]] = set()
 
-    invoices_doc = root.find("ns:invoicesDoc", ns)
-    if invoices_doc is None:
-        return items, issuers_without_items, next_partition_key, next_row_key
-
-    invoices = invoices_doc.findall("ns:invoice", ns)
-
-    for invoice in invoices:
-        # Get issuer information
-        issuer = invoice.find("ns:issuer", ns)
-        if issuer is None:
-            continue
-
-        issuer_vat_elem = issuer.find("ns:vatNumber", ns)
-        issuer_name_elem = issuer.find("ns:name", ns)
-
-        issuer_vat = issuer_vat_elem.text.strip() if issuer_vat_elem is not None and issuer_vat_elem.text else ""
-        issuer_name = issuer_name_elem.text.strip() if issuer_name_elem is not None and issuer_name_elem.text else ""
-
-        # Get invoice details (line items)
-        invoice_details_list = invoice.findall("ns:invoiceDetails", ns)
-
-        if not invoice_details_list:
-            # No invoice details at all
-            if issuer_vat or issuer_name:
-                issuers_without_items.add((issuer_vat, issuer_name))
-            continue
-
-        has_item_with_description = False
-
-        for invoice_details in invoice_details_list:
-            item_descr_elem = invoice_details.find("ns:itemDescr", ns)
-            quantity_elem = invoice_details.find("ns:quantity", ns)
-            net_value_elem = invoice_details.find("ns:netValue", ns)
-
-            item_descr = item_descr_elem.text.strip() if item_descr_elem is not None and item_descr_elem.text else ""
-
-            if not item_descr:
-                # This invoiceDetails block has no item description
-                continue
-
-            has_item_with_description = True
-
-            # Parse quantity (default to 1 if not present or invalid)
-            quantity = 1.0
-            if quantity_elem is not None and quantity_elem.text:
-                try:
-                    quantity = float(quantity_elem.text)
-                except ValueError:
-                    quantity = 1.0
-
-            # Parse net value (default to 0 if not present or invalid)
-            net_value = 0.0
-            if net_value_elem is not None and net_value_elem.text:
-                try:
-                    net_value = float(net_value_elem.text)
-                except ValueError:
-                    net_value = 0.0
-
-            items.append({
-                "item_descr": item_descr,
-                "quantity": quantity,
-                "net_value": net_value
-            })
+    # Stream the document invoice-by-invoice instead of building the full DOM;
+    # each processed element is cleared so peak memory stays at one invoice.
+    context = etree.iterparse(
+        BytesIO(xml_content),
+        events=('end',),
+        tag=(TAG_INVOICE, TAG_CONTINUATION_TOKEN),
+        # The XML comes off the network: never expand entities or touch
+        # external resources while parsing it
+        resolve_entities=False,
+        no_network=True,
+    )
 
-        if not has_item_with_description and (issuer_vat or issuer_name):
-            issuers_without_items.add((issuer_vat, issuer_name))
+    try:
+        for _event, elem in context:
+            if elem.tag == TAG_CONTINUATION_TOKEN:
+                npk = elem.find(TAG_NEXT_PARTITION_KEY)
+                nrk = elem.find(TAG_NEXT_ROW_KEY)
+                if npk is not None:
+                    next_partition_key = npk.text
+                if nrk is not None:
+                    next_row_key = nrk.text
+            else:
+                # Get issuer information
+                issuer = elem.find(TAG_ISSUER)
+                if issuer is not None:
+                    # One pass over the children instead of a find() per field
+                    issuer_fields = {child.tag: child.text for child in issuer}
+
+                    issuer_vat_raw = issuer_fields.get(TAG_VAT_NUMBER)
+                    issuer_name_raw = issuer_fields.get(TAG_NAME)
+                    issuer_vat = issuer_vat_raw.strip() if issuer_vat_raw else ""
+                    issuer_name = issuer_name_raw.strip() if issuer_name_raw else ""
+
+                    # Get invoice details (line items)
+                    invoice_details_list = elem.findall(TAG_INVOICE_DETAILS)
+
+                    if not invoice_details_list:
+                        # No invoice details at all
+                        if issuer_vat or issuer_name:
+                            issuers_without_items.add((issuer_vat, issuer_name))
+                    else:
+                        has_item_with_description = False
+
+                        for invoice_details in invoice_details_list:
+                            detail_fields = {child.tag: child.text for child in invoice_details}
+
+                            item_descr_raw = detail_fields.get(TAG_ITEM_DESCR)
+                            item_descr = item_descr_raw.strip() if item_descr_raw else ""
+
+                            if not item_descr:
+                                # This invoiceDetails block has no item description
+                                continue
+
+                            has_item_with_description = True
+
+                            # Parse quantity (default to 1 if not present or invalid)
+                            quantity = _to_float(detail_fields.get(TAG_QUANTITY), 1.0)
+
+                            # Parse net value (default to 0 if not present or invalid)
+                            net_value = _to_float(detail_fields.get(TAG_NET_VALUE), 0.0)
+
+                            descrs.append(item_descr)
+                            qtys.append(quantity)
+                            nets.append(net_value)
+
+                        if not has_item_with_description and (issuer_vat or issuer_name):
+                            issuers_without_items.add((issuer_vat, issuer_name))
+
+            # Free the processed element and any already-parsed siblings
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+    except etree.XMLSyntaxError as e:
+        print(f"Error parsing XML: {e}", file=sys.stderr)
+        return [], array('d'), array('d'), set(), None, None
 
-    return items, issuers_without_items, next_partition_key, next_row_key
+    return descrs, qtys, nets, issuers_without_items, next_partition_key, next_row_key
 
 
-def fetch_all_items(date_from: str, date_to: str) -> Tuple[List[Dict], Set[Tuple[str, str]]]:
+def fetch_all_items(date_from: str, date_to: str) -> Tuple[List[str], array, array, Set[Tuple[str, str]]]:
     """
     Fetch all invoice items for a date range.
 
@@ -199,67 +280,89 @@ def fetch_all_items(date_from: str, date_to: str) -> Tuple[List[Dict], Set[Tuple
         date_to: End date in YYYY-MM-DD format
 
     Returns:
-        Tuple of (list of item records, set of (vat, name) for issuers without items)
+        Tuple of (descriptions, quantities, net values,
+                  set of (vat, name) for issuers without items)
     """
     print(f"Fetching all invoices for date range: {date_from} to {date_to}")
 
-    all_items = []
+    all_descrs: List[str] = []
+    all_qtys = array('d')
+    all_nets = array('d')
     all_issuers_without_items: Set[Tuple[str, str]] = set()
-    next_partition_key = None
-    next_row_key = None
     page = 1
 
-    while True:
-        xml_content = fetch_invoices(
-            date_from, date_to,
-            next_partition_key=next_partition_key,
-            next_row_key=next_row_key
-        )
-
-        if not xml_content:
-            break
-
-        items, issuers_without_items, next_partition_key, next_row_key = parse_invoice_items(xml_content)
-        all_items.extend(items)
-        all_issuers_without_items.update(issuers_without_items)
-
-        print(f"  Page {page}: Found {len(items)} item(s)")
-        page += 1
-
-        if not next_partition_key or not next_row_key:
-            break
-
-    print(f"\nTotal line items fetched: {len(all_items)}")
+    # Depth-1 pipeline: peek the continuation tokens off the raw XML and start
+    # fetching the next page while the current one is being parsed
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch_invoices, date_from, date_to)
+
+        while True:
+            xml_content = future.result()
+            future = None
+
+            if not xml_content:
+                break
+
+            peek_npk, peek_nrk = _peek_continuation(xml_content)
+            if peek_npk and peek_nrk:
+                future = executor.submit(
+                    fetch_invoices, date_from, date_to, peek_npk, peek_nrk
+                )
+
+            descrs, qtys, nets, issuers_without_items, next_partition_key, next_row_key = parse_invoice_items(xml_content)
+            all_descrs.extend(descrs)
+            all_qtys.extend(qtys)
+            all_nets.extend(nets)
+            all_issuers_without_items.update(issuers_without_items)
+
+            print(f"  Page {page}: Found {len(descrs)} item(s)")
+            page += 1
+
+            if future is None:
+                if next_partition_key and next_row_key:
+                    # The peek missed the tokens; fall back to a serial fetch
+                    future = executor.submit(
+                        fetch_invoices, date_from, date_to,
+                        next_partition_key, next_row_key
+                    )
+                else:
+                    break
+
+    print(f"\nTotal line items fetched: {len(all_descrs)}")
     print(f"Issuers without item descriptions: {len(all_issuers_without_items)}")
 
-    return all_items, all_issuers_without_items
+    return all_descrs, all_qtys, all_nets, all_issuers_without_items
 
 
-def aggregate_items(items: List[Dict]) -> List[Dict]:
+def aggregate_items(descrs: List[str], qtys: array, nets: array) -> List[Dict]:
     """
     Aggregate items by description, calculating total quantity and average net value.
 
     Args:
-        items: List of item records
+        descrs: Item descriptions (one per line item)
+        qtys: Quantities, parallel to descrs
+        nets: Net values, parallel to descrs
 
     Returns:
         List of aggregated records with item_descr, total_quantity, avg_net_value
     """
-    # Group by item description
-    aggregated: Dict[str, Dict] = defaultdict(lambda: {"total_quantity": 0.0, "net_values": []})
+    # Group by item description with running (total_quantity, net_sum, count)
+    # accumulators - a single pass that retains nothing per item
+    aggregated: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0.0, 0])
 
-    for item in items:
-        descr = item["item_descr"]
-        aggregated[descr]["total_quantity"] += item["quantity"]
-        aggregated[descr]["net_values"].append(item["net_value"])
+    for descr, quantity, net_value in zip(descrs, qtys, nets):
+        entry = aggregated[descr]
+        entry[0] += quantity
+        entry[1] += net_value
+        entry[2] += 1
 
     # Calculate averages and build result
     result = []
-    for descr, data in sorted(aggregated.items()):
-        avg_value = sum(data["net_values"]) / len(data["net_values"]) if data["net_values"] else 0.0
+    for descr, (total_quantity, net_sum, count) in sorted(aggregated.items()):
+        avg_value = net_sum / count if count else 0.0
         result.append({
             "item_descr": descr,
-            "total_quantity": data["total_quantity"],
+            "total_quantity": total_quantity,
             "avg_net_value": round(avg_value, 2)
         })
 
@@ -268,11 +371,13 @@ def aggregate_items(items: List[Dict]) -> List[Dict]:
 
 def write_items_csv(aggregated_items: List[Dict], output_file: str):
     """Write aggregated items to CSV file."""
-    with open(output_file, 'w', newline='', encoding='utf-8') as f:
+    with open(output_file, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
         writer = csv.writer(f)
         writer.writerow(["Item Description", "Total Quantity", "Average Net Value"])
-        for item in aggregated_items:
-            writer.writerow([item["item_descr"], item["total_quantity"], item["avg_net_value"]])
+        writer.writerows(
+            (item["item_descr"], item["total_quantity"], item["avg_net_value"])
+            for item in aggregated_items
+        )
 
     print(f"Wrote {len(aggregated_items)} item(s) to {output_file}")
 
@@ -280,8 +385,7 @@ def write_items_csv(aggregated_items: List[Dict], output_file: str):
 def write_issuers_without_items(issuers: Set[Tuple[str, str]], output_file: str):
     """Write issuers without item descriptions to file."""
     with open(output_file, 'w', encoding='utf-8') as f:
-        for vat, name in sorted(issuers):
-            f.write(f"{vat}\t{name}\n")
+        f.write("".join(f"{vat}\t{name}\n" for vat, name in sorted(issuers)))
 
     print(f"Wrote {len(issuers)} issuer(s) to {output_file}")
 
@@ -335,15 +439,15 @@ def main():
         sys.exit(1)
 
     # Fetch all items
-    items, issuers_without_items = fetch_all_items(date_from, date_to)
+    descrs, qtys, nets, issuers_without_items = fetch_all_items(date_from, date_to)
 
-    if not items and not issuers_without_items:
+    if not descrs and not issuers_without_items:
         print("\nNo invoice data found")
         sys.exit(0)
 
     # Aggregate items by description
-    if items:
-        aggregated = aggregate_items(items)
+    if descrs:
+        aggregated = aggregate_items(descrs, qtys, nets)
         write_items_csv(aggregated, args.output)
 
     # Write issuers without item descriptions
@@ -4,15 +4,23 @@ Fetch all invoices from myDATA API and write detailed line items to Excel.
 Excludes credit note invoice types (5, 5.1, 5.2).
 """
 import argparse
+import csv
+import functools
 import os
+import re
 import sys
-import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from io import BytesIO
 from typing import List, Dict, Optional, Tuple
+import orjson
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from lxml import etree
 from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,6 +30,34 @@ USER_ID = os.getenv("MYDATA_USER_ID")
 API_KEY = os.getenv("MYDATA_API_KEY")
 API_BASE_URL = "https://mydatapi.aade.gr/myDATA/RequestDocs"
 
+# myDATA XML namespace and precomputed Clark-notation tags, so element
+# lookups skip the per-call prefix/namespace-dict resolution
+NS_URI = "http://www.aade.gr/myDATA/invoice/v1.0"
+TAG_INVOICE = f"{{{NS_URI}}}invoice"
+TAG_CONTINUATION_TOKEN = f"{{{NS_URI}}}continuationToken"
+TAG_NEXT_PARTITION_KEY = f"{{{NS_URI}}}nextPartitionKey"
+TAG_NEXT_ROW_KEY = f"{{{NS_URI}}}nextRowKey"
+TAG_ISSUER = f"{{{NS_URI}}}issuer"
+TAG_VAT_NUMBER = f"{{{NS_URI}}}vatNumber"
+TAG_NAME = f"{{{NS_URI}}}name"
+TAG_INVOICE_HEADER = f"{{{NS_URI}}}invoiceHeader"
+TAG_INVOICE_TYPE = f"{{{NS_URI}}}invoiceType"
+TAG_ISSUE_DATE = f"{{{NS_URI}}}issueDate"
+TAG_SERIES = f"{{{NS_URI}}}series"
+TAG_AA = f"{{{NS_URI}}}aa"
+TAG_INVOICE_DETAILS = f"{{{NS_URI}}}invoiceDetails"
+TAG_ITEM_CODE = f"{{{NS_URI}}}itemCode"
+TAG_ITEM_DESCR = f"{{{NS_URI}}}itemDescr"
+TAG_QUANTITY = f"{{{NS_URI}}}quantity"
+TAG_MEASUREMENT_UNIT = f"{{{NS_URI}}}measurementUnit"
+TAG_NET_VALUE = f"{{{NS_URI}}}netValue"
+TAG_VAT_CATEGORY = f"{{{NS_URI}}}vatCategory"
+TAG_VAT_AMOUNT = f"{{{NS_URI}}}vatAmount"
+
+# Credit note invoice types, excluded from the output
+EXCLUDED_INVOICE_TYPES = frozenset({"5", "5.1", "5.2"})
+
+
 MEASUREMENT_UNIT_MAP = {
     "1": "Τεμάχια",
     "2": "Κιλά",
@@ -49,9 +85,70 @@ if not USER_ID or not API_KEY:
     print("Error: MYDATA_USER_ID and MYDATA_API_KEY environment variables must be set", file=sys.stderr)
     sys.exit(1)
 
+# Shared session so paginated requests reuse pooled TCP/TLS connections and
+# transient failures are retried inside urllib3; auth headers are set once
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=3))
+SESSION.headers.update({
+    "aade-user-id": USER_ID,
+    "Ocp-Apim-Subscription-Key": API_KEY,
+    # myDATA pages are large, highly compressible XML; brotli/gzip cut the
+    # bytes on the wire by 5-10x
+    "Accept-Encoding": "br, gzip, deflate",
+})
+
+
+def _to_float(text: Optional[str], default: Optional[float] = None, _float=float) -> Optional[float]:
+    """
+    Parse a numeric XML payload, returning default when text is missing or invalid.
+    float() already tolerates surrounding whitespace, so no strip() is needed;
+    the builtin is bound as a default arg to keep the lookup local in the hot loop.
+    """
+    if not text:
+        return default
+    try:
+        return _float(text)
+    except ValueError:
+        return default
+
+
+# Cheap pre-scan for pagination tokens so the next page request can be issued
+# before the current page is fully parsed (the parser remains authoritative)
+_NEXT_PARTITION_KEY_RE = re.compile(rb"<(?:\w+:)?nextPartitionKey>([^<]+)</")
+_NEXT_ROW_KEY_RE = re.compile(rb"<(?:\w+:)?nextRowKey>([^<]+)</")
+
+# Entity and numeric character references that may appear inside a token;
+# the peek must undo them exactly as the parser would, or an escaped token
+# (legal in Azure Table keys) would be sent back to the API verbatim
+_XML_REF_RE = re.compile(r"&(?:#(\d+)|#x([0-9a-fA-F]+)|(amp|lt|gt|apos|quot));")
+_XML_NAMED_REFS = {"amp": "&", "lt": "<", "gt": ">", "apos": "'", "quot": '"'}
+
+
+def _unescape_xml(text: str) -> str:
+    """Resolve predefined XML entities and character references."""
+    return _XML_REF_RE.sub(
+        lambda m: chr(int(m[1])) if m[1] else (chr(int(m[2], 16)) if m[2] else _XML_NAMED_REFS[m[3]]),
+        text,
+    )
+
+
+
+def _peek_continuation(xml_content: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """Scan the raw XML for continuation tokens without parsing it."""
+    npk = _NEXT_PARTITION_KEY_RE.search(xml_content)
+    nrk = _NEXT_ROW_KEY_RE.search(xml_content)
+    return (
+        _unescape_xml(npk.group(1).decode('utf-8')) if npk else None,
+        _unescape_xml(nrk.group(1).decode('utf-8')) if nrk else None,
+    )
 
+
+@functools.lru_cache(maxsize=32)
 def convert_date_to_api_format(date_str: str) -> str:
-    """Convert date from YYYY-MM-DD to DD/MM/YYYY format for API."""
+    """
+    Convert date from YYYY-MM-DD to DD/MM/YYYY format for API.
+    Cached: the same two bounds are re-converted on every paginated request.
+    """
     date_obj = datetime.strptime(date_str, "%Y-%m-%d")
     return date_obj.strftime("%d/%m/%Y")
 
@@ -61,7 +158,7 @@ def fetch_invoices(
     date_to: str,
     next_partition_key: Optional[str] = None,
     next_row_key: Optional[str] = None
-) -> str:
+) -> bytes:
     """Fetch invoices from myDATA API."""
     api_date_from = convert_date_to_api_format(date_from)
     api_date_to = convert_date_to_api_format(date_to)
@@ -77,23 +174,20 @@ def fetch_invoices(
     if next_row_key:
         params["nextRowKey"] = next_row_key
 
-    headers = {
-        "aade-user-id": USER_ID,
-        "Ocp-Apim-Subscription-Key": API_KEY
-    }
-
     try:
-        response = requests.get(API_BASE_URL, params=params, headers=headers, timeout=30)
+        response = SESSION.get(API_BASE_URL, params=params, timeout=30)
         response.raise_for_status()
-        return response.text
+        # Raw bytes: lxml reads the XML encoding declaration itself, so the
+        # full-body str decode response.text would do is never needed
+        return response.content
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data: {e}", file=sys.stderr)
         if hasattr(e, 'response') and e.response is not None:
             print(f"Response text: {e.response.text}", file=sys.stderr)
-        return ""
+        return b""
 
 
-def parse_invoices(xml_content: str) -> Tuple[List[Dict], Optional[str], Optional[str]]:
+def parse_invoices(xml_content: bytes) -> Tuple[List[Dict], Optional[str], Optional[str]]:
     """
     Parse XML response and extract invoice line item rows.
     Skips invoices with invoice_type in ["5", "5.1", "5.2"].
@@ -105,141 +199,151 @@ def parse_invoices(xml_content: str) -> Tuple[List[Dict], Optional[str], Optiona
     if not xml_content:
         return [], None, None
 
+    # Pagination tokens
+    next_partition_key = None
+    next_row_key = None
+
+    rows = []
+
+    # Stream the document invoice-by-invoice instead of building the full DOM;
+    # each processed element is cleared so peak memory stays at one invoice.
+    context = etree.iterparse(
+        BytesIO(xml_content),
+        events=('end',),
+        tag=(TAG_INVOICE, TAG_CONTINUATION_TOKEN),
+        # The XML comes off the network: never expand entities or touch
+        # external resources while parsing it
+        resolve_entities=False,
+        no_network=True,
+    )
+
     try:
-        root = ET.fromstring(xml_content)
-    except ET.ParseError as e:
+        for _event, elem in context:
+            if elem.tag == TAG_CONTINUATION_TOKEN:
+                npk = elem.find(TAG_NEXT_PARTITION_KEY)
+                nrk = elem.find(TAG_NEXT_ROW_KEY)
+                if npk is not None:
+                    next_partition_key = npk.text
+                if nrk is not None:
+                    next_row_key = nrk.text
+            else:
+                rows.extend(_extract_invoice_rows(elem))
+
+            # Free the processed element and any already-parsed siblings
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+    except etree.XMLSyntaxError as e:
         print(f"Error parsing XML: {e}", file=sys.stderr)
         return [], None, None
 
-    ns = {'ns': 'http://www.aade.gr/myDATA/invoice/v1.0'}
+    return rows, next_partition_key, next_row_key
 
-    # Extract pagination tokens
-    next_partition_key = None
-    next_row_key = None
 
-    continuation_token = root.find("ns:continuationToken", ns)
-    if continuation_token is not None:
-        npk = continuation_token.find("ns:nextPartitionKey", ns)
-        nrk = continuation_token.find("ns:nextRowKey", ns)
-        if npk is not None:
-            next_partition_key = npk.text
-        if nrk is not None:
-            next_row_key = nrk.text
+def _extract_invoice_rows(invoice) -> List[Dict]:
+    """
+    Extract line-item rows from a single invoice element.
+    Returns an empty list for excluded (credit note) invoice types.
+    """
+    # Get invoice header and check type
+    invoice_header = invoice.find(TAG_INVOICE_HEADER)
+    if invoice_header is None:
+        return []
+
+    # One pass over the children instead of a find() per field
+    header_fields = {child.tag: child.text for child in invoice_header}
+
+    invoice_type_raw = header_fields.get(TAG_INVOICE_TYPE)
+    invoice_type = invoice_type_raw.strip() if invoice_type_raw else ""
+
+    if invoice_type in EXCLUDED_INVOICE_TYPES:
+        return []
+
+    # Get issuer information; issuer strings repeat across rows and invoices,
+    # so intern them to share one object per distinct value
+    _intern = sys.intern
+    issuer = invoice.find(TAG_ISSUER)
+    issuer_vat = ""
+    issuer_name = ""
+    if issuer is not None:
+        issuer_fields = {child.tag: child.text for child in issuer}
+        vat_raw = issuer_fields.get(TAG_VAT_NUMBER)
+        name_raw = issuer_fields.get(TAG_NAME)
+        issuer_vat = _intern(vat_raw.strip()) if vat_raw else ""
+        issuer_name = _intern(name_raw.strip()) if name_raw else ""
+
+    # Get header fields
+    issue_date_raw = header_fields.get(TAG_ISSUE_DATE)
+    series_raw = header_fields.get(TAG_SERIES)
+    aa_raw = header_fields.get(TAG_AA)
+
+    issue_date = issue_date_raw.strip() if issue_date_raw else ""
+    series = series_raw.strip() if series_raw else ""
+    aa = aa_raw.strip() if aa_raw else ""
+
+    # Get all invoiceDetails elements
+    invoice_details_list = invoice.findall(TAG_INVOICE_DETAILS)
+
+    if not invoice_details_list:
+        # Invoice with no details: emit one row with blank detail fields
+        return [{
+            "issuer_vat": issuer_vat,
+            "issuer_name": issuer_name,
+            "issue_date": issue_date,
+            "series": series,
+            "aa": aa,
+            "item_code": "",
+            "item_descr": "",
+            "quantity": None,
+            "measurement_unit": "",
+            "net_value": None,
+            "vat_category": "",
+            "vat_amount": None,
+        }]
 
     rows = []
-    excluded_types = {"5", "5.1", "5.2"}
-
-    invoices_doc = root.find("ns:invoicesDoc", ns)
-    if invoices_doc is None:
-        return rows, next_partition_key, next_row_key
-
-    for invoice in invoices_doc.findall("ns:invoice", ns):
-        # Get invoice header and check type
-        invoice_header = invoice.find("ns:invoiceHeader", ns)
-        if invoice_header is None:
-            continue
-
-        invoice_type_elem = invoice_header.find("ns:invoiceType", ns)
-        invoice_type = invoice_type_elem.text.strip() if invoice_type_elem is not None and invoice_type_elem.text else ""
-
-        if invoice_type in excluded_types:
-            continue
-
-        # Get issuer information
-        issuer = invoice.find("ns:issuer", ns)
-        issuer_vat = ""
-        issuer_name = ""
-        if issuer is not None:
-            vat_elem = issuer.find("ns:vatNumber", ns)
-            name_elem = issuer.find("ns:name", ns)
-            issuer_vat = vat_elem.text.strip() if vat_elem is not None and vat_elem.text else ""
-            issuer_name = name_elem.text.strip() if name_elem is not None and name_elem.text else ""
-
-        # Get header fields
-        issue_date_elem = invoice_header.find("ns:issueDate", ns)
-        series_elem = invoice_header.find("ns:series", ns)
-        aa_elem = invoice_header.find("ns:aa", ns)
-
-        issue_date = issue_date_elem.text.strip() if issue_date_elem is not None and issue_date_elem.text else ""
-        series = series_elem.text.strip() if series_elem is not None and series_elem.text else ""
-        aa = aa_elem.text.strip() if aa_elem is not None and aa_elem.text else ""
-
-        # Get all invoiceDetails elements
-        invoice_details_list = invoice.findall("ns:invoiceDetails", ns)
-
-        if not invoice_details_list:
-            # Invoice with no details: emit one row with blank detail fields
-            rows.append({
-                "issuer_vat": issuer_vat,
-                "issuer_name": issuer_name,
-                "issue_date": issue_date,
-                "series": series,
-                "aa": aa,
-                "item_code": "",
-                "item_descr": "",
-                "quantity": None,
-                "measurement_unit": "",
-                "net_value": None,
-                "vat_category": "",
-                "vat_amount": None,
-            })
-            continue
-
-        for detail in invoice_details_list:
-            item_code_elem = detail.find("ns:itemCode", ns)
-            item_descr_elem = detail.find("ns:itemDescr", ns)
-            quantity_elem = detail.find("ns:quantity", ns)
-            measurement_unit_elem = detail.find("ns:measurementUnit", ns)
-            net_value_elem = detail.find("ns:netValue", ns)
-            vat_category_elem = detail.find("ns:vatCategory", ns)
-            vat_amount_elem = detail.find("ns:vatAmount", ns)
-
-            # Parse numeric fields
-            quantity = None
-            if quantity_elem is not None and quantity_elem.text:
-                try:
-                    quantity = float(quantity_elem.text.strip())
-                except ValueError:
-                    pass
-
-            net_value = None
-            if net_value_elem is not None and net_value_elem.text:
-                try:
-                    net_value = float(net_value_elem.text.strip())
-                except ValueError:
-                    pass
-
-            vat_amount = None
-            if vat_amount_elem is not None and vat_amount_elem.text:
-                try:
-                    vat_amount = float(vat_amount_elem.text.strip())
-                except ValueError:
-                    pass
-
-            # Map measurement unit code to text
-            mu_raw = measurement_unit_elem.text.strip() if measurement_unit_elem is not None and measurement_unit_elem.text else ""
-            measurement_unit = MEASUREMENT_UNIT_MAP.get(mu_raw, "Άγνωστο") if mu_raw else ""
-
-            # Map VAT category code to text
-            vc_raw = vat_category_elem.text.strip() if vat_category_elem is not None and vat_category_elem.text else ""
-            vat_category = VAT_CATEGORY_MAP.get(vc_raw, vc_raw)
-
-            rows.append({
-                "issuer_vat": issuer_vat,
-                "issuer_name": issuer_name,
-                "issue_date": issue_date,
-                "series": series,
-                "aa": aa,
-                "item_code": item_code_elem.text.strip() if item_code_elem is not None and item_code_elem.text else "",
-                "item_descr": item_descr_elem.text.strip() if item_descr_elem is not None and item_descr_elem.text else "",
-                "quantity": quantity,
-                "measurement_unit": measurement_unit,
-                "net_value": net_value,
-                "vat_category": vat_category,
-                "vat_amount": vat_amount,
-            })
-
-    return rows, next_partition_key, next_row_key
+    for detail in invoice_details_list:
+        detail_fields = {child.tag: child.text for child in detail}
+
+        # Parse numeric fields
+        quantity = _to_float(detail_fields.get(TAG_QUANTITY))
+        net_value = _to_float(detail_fields.get(TAG_NET_VALUE))
+        vat_amount = _to_float(detail_fields.get(TAG_VAT_AMOUNT))
+
+        # Map measurement unit code to text
+        mu_text = detail_fields.get(TAG_MEASUREMENT_UNIT)
+        mu_raw = mu_text.strip() if mu_text else ""
+        measurement_unit = MEASUREMENT_UNIT_MAP.get(mu_raw, "Άγνωστο") if mu_raw else ""
+
+        # Map VAT category code to text; the map values are shared literals
+        # already, so only the unknown-code passthrough needs interning
+        vc_text = detail_fields.get(TAG_VAT_CATEGORY)
+        vc_raw = vc_text.strip() if vc_text else ""
+        vat_category = VAT_CATEGORY_MAP.get(vc_raw)
+        if vat_category is None:
+            vat_category = _intern(vc_raw)
+
+        item_code_raw = detail_fields.get(TAG_ITEM_CODE)
+        item_descr_raw = detail_fields.get(TAG_ITEM_DESCR)
+
+        rows.append({
+            "issuer_vat": issuer_vat,
+            "issuer_name": issuer_name,
+            "issue_date": issue_date,
+            "series": series,
+            "aa": aa,
+            "item_code": item_code_raw.strip() if item_code_raw else "",
+            "item_descr": item_descr_raw.strip() if item_descr_raw else "",
+            "quantity": quantity,
+            "measurement_unit": measurement_unit,
+            "net_value": net_value,
+            "vat_category": vat_category,
+            "vat_amount": vat_amount,
+        })
+
+    return rows
 
 
 def fetch_all_invoices(date_from: str, date_to: str) -> List[Dict]:
@@ -247,76 +351,131 @@ def fetch_all_invoices(date_from: str, date_to: str) -> List[Dict]:
     print(f"Fetching all invoices for date range: {date_from} to {date_to}")
 
     all_rows = []
-    next_partition_key = None
-    next_row_key = None
     page = 1
 
-    while True:
-        xml_content = fetch_invoices(
-            date_from, date_to,
-            next_partition_key=next_partition_key,
-            next_row_key=next_row_key
-        )
+    # Depth-1 pipeline: peek the continuation tokens off the raw XML and start
+    # fetching the next page while the current one is being parsed
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch_invoices, date_from, date_to)
+
+        while True:
+            xml_content = future.result()
+            future = None
+
+            if not xml_content:
+                break
 
-        if not xml_content:
-            break
+            peek_npk, peek_nrk = _peek_continuation(xml_content)
+            if peek_npk and peek_nrk:
+                future = executor.submit(
+                    fetch_invoices, date_from, date_to, peek_npk, peek_nrk
+                )
 
-        rows, next_partition_key, next_row_key = parse_invoices(xml_content)
-        all_rows.extend(rows)
+            rows, next_partition_key, next_row_key = parse_invoices(xml_content)
+            all_rows.extend(rows)
 
-        print(f"  Page {page}: {len(rows)} row(s)")
-        page += 1
+            print(f"  Page {page}: {len(rows)} row(s)")
+            page += 1
 
-        if not next_partition_key or not next_row_key:
-            break
+            if future is None:
+                if next_partition_key and next_row_key:
+                    # The peek missed the tokens; fall back to a serial fetch
+                    future = executor.submit(
+                        fetch_invoices, date_from, date_to,
+                        next_partition_key, next_row_key
+                    )
+                else:
+                    break
 
     print(f"Total rows: {len(all_rows)}")
     return all_rows
 
 
+# Output column order, display headers, and which columns are numeric
+FIELDNAMES = [
+    "issuer_vat", "issuer_name", "issue_date", "series", "aa",
+    "item_code", "item_descr", "quantity", "measurement_unit",
+    "net_value", "vat_category", "vat_amount"
+]
+HEADER = [
+    "Issuer VAT", "Issuer Name", "Issue Date", "Series", "AA",
+    "Item Code", "Item Description", "Quantity", "Measurement Unit",
+    "Net Value", "VAT Category", "VAT Amount"
+]
+NUMERIC_FIELDS = frozenset({"quantity", "net_value", "vat_amount"})
+
+
+def write_output(rows: List[Dict], output_file: str):
+    """
+    Write rows to the output file, dispatching on the file extension.
+    .csv and .jsonl stream straight to disk and skip the XLSX writer
+    (zipped XML) entirely; anything else gets the Excel path.
+    """
+    ext = os.path.splitext(output_file)[1].lower()
+    if ext == ".csv":
+        write_csv(rows, output_file)
+    elif ext == ".jsonl":
+        write_jsonl(rows, output_file)
+    else:
+        write_excel(rows, output_file)
+
+
+def write_csv(rows: List[Dict], output_file: str):
+    """Write rows to a CSV file."""
+    with open(output_file, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(tuple(row[field] for field in FIELDNAMES) for row in rows)
+    print(f"Wrote {len(rows)} row(s) to {output_file}")
+
+
+def write_jsonl(rows: List[Dict], output_file: str):
+    """Write rows to a JSON Lines file, one row dict per line."""
+    with open(output_file, 'wb', buffering=1 << 20) as f:
+        write = f.write
+        for row in rows:
+            write(orjson.dumps(row))
+            write(b'\n')
+    print(f"Wrote {len(rows)} row(s) to {output_file}")
+
+
 def write_excel(rows: List[Dict], output_file: str):
     """Write rows to Excel file with proper formatting."""
-    fieldnames = [
-        "issuer_vat", "issuer_name", "issue_date", "series", "aa",
-        "item_code", "item_descr", "quantity", "measurement_unit",
-        "net_value", "vat_category", "vat_amount"
-    ]
-    header = [
-        "Issuer VAT", "Issuer Name", "Issue Date", "Series", "AA",
-        "Item Code", "Item Description", "Quantity", "Measurement Unit",
-        "Net Value", "VAT Category", "VAT Amount"
-    ]
-    # Columns that should be numeric (0-indexed within fieldnames)
-    numeric_fields = {"quantity", "net_value", "vat_amount"}
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Invoices"
-
-    # Write header
-    for col_idx, col_name in enumerate(header, 1):
-        ws.cell(row=1, column=col_idx, value=col_name)
-
-    # Format all columns as text by default
-    for col_idx in range(1, len(fieldnames) + 1):
-        col_letter = get_column_letter(col_idx)
-        for cell in ws[col_letter]:
-            cell.number_format = '@'
+    fieldnames = FIELDNAMES
+    header = HEADER
+    numeric_fields = NUMERIC_FIELDS
+
+    # Write-only mode streams each row straight to the XLSX archive instead
+    # of keeping every cell object in memory until save()
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Invoices")
+
+    # Register the two formats as named styles once; cells then reference a
+    # shared style instead of openpyxl deduplicating a per-cell format string
+    # for every one of the rows x 12 cells on save
+    text_style = NamedStyle(name="txt", number_format='@')
+    num_style = NamedStyle(name="num", number_format='0.00')
+    wb.add_named_style(text_style)
+    wb.add_named_style(num_style)
+
+    ws.append(header)
 
     # Write data rows
-    for row_idx, row in enumerate(rows, 2):
-        for col_idx, field in enumerate(fieldnames, 1):
+    for row in rows:
+        cells = []
+        for field in fieldnames:
             value = row[field]
-            cell = ws.cell(row=row_idx, column=col_idx)
+            cell = WriteOnlyCell(ws)
             if field in numeric_fields:
                 # Write as number (None becomes empty cell)
                 if value is not None:
                     cell.value = value
-                    cell.number_format = '0.00'
-                # else leave cell empty
+                    cell.style = num_style
             else:
                 cell.value = str(value) if value else ""
-                cell.number_format = '@'
+                cell.style = text_style
+            cells.append(cell)
+        ws.append(cells)
 
     wb.save(output_file)
     print(f"Wrote {len(rows)} row(s) to {output_file}")
@@ -346,7 +505,8 @@ def main():
     parser.add_argument(
         "--output",
         default="complete_invoices.xlsx",
-        help="Output Excel file (default: complete_invoices.xlsx)"
+        help="Output file; format follows the extension "
+             "(.xlsx, .csv, .jsonl; default: complete_invoices.xlsx)"
     )
 
     args = parser.parse_args()
@@ -369,7 +529,7 @@ def main():
         print("\nNo invoice data found")
         sys.exit(0)
 
-    write_excel(rows, args.output)
+    write_output(rows, args.output)
     print("\nDone!")
 
 
@@ -3,13 +3,29 @@
 Fetch expense invoice data from myDATA API and append to Google Sheets.
 """
 import argparse
+import functools
+import math
 import os
+import random
+import re
+import sqlite3
 import sys
-import xml.etree.ElementTree as ET
+import tempfile
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from io import BytesIO
+from queue import Queue
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
+from urllib.parse import quote
+import orjson
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from lxml import etree
+from google.auth.transport.requests import Request as GoogleAuthRequest
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -23,6 +39,42 @@ API_KEY = os.getenv("MYDATA_API_KEY")
 API_BASE_URL = "https://mydatapi.aade.gr/myDATA/RequestDocs"
 GOOGLE_SPREADSHEET_ID = os.getenv("GOOGLE_SPREADSHEET_ID")
 GOOGLE_CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "google-credentials.json")
+DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH", "seen_keys.db")
+
+# myDATA XML namespace and precomputed Clark-notation tags, so element
+# lookups skip the per-call prefix/namespace-dict resolution
+NS_URI = "http://www.aade.gr/myDATA/invoice/v1.0"
+TAG_INVOICE = f"{{{NS_URI}}}invoice"
+TAG_CONTINUATION_TOKEN = f"{{{NS_URI}}}continuationToken"
+TAG_NEXT_PARTITION_KEY = f"{{{NS_URI}}}nextPartitionKey"
+TAG_NEXT_ROW_KEY = f"{{{NS_URI}}}nextRowKey"
+
+# XPath expressions compiled once at import; each call then runs a prebuilt
+# libxml2 XPath program instead of re-tokenizing the path and re-resolving
+# the namespace mapping per invoice. The text() selectors return the leaf
+# strings directly without building element wrappers.
+_NS = {"ns": NS_URI}
+_XP_ISSUER = etree.XPath("ns:issuer", namespaces=_NS)
+_XP_ISSUER_VAT = etree.XPath("ns:issuer/ns:vatNumber/text()", namespaces=_NS)
+_XP_ISSUER_NAME = etree.XPath("ns:issuer/ns:name/text()", namespaces=_NS)
+_XP_RECEIVER_VAT = etree.XPath("ns:counterpart/ns:vatNumber/text()", namespaces=_NS)
+_XP_INVOICE_HEADER = etree.XPath("ns:invoiceHeader", namespaces=_NS)
+_XP_ISSUE_DATE = etree.XPath("ns:invoiceHeader/ns:issueDate/text()", namespaces=_NS)
+_XP_SERIES = etree.XPath("ns:invoiceHeader/ns:series/text()", namespaces=_NS)
+_XP_AA = etree.XPath("ns:invoiceHeader/ns:aa/text()", namespaces=_NS)
+_XP_INVOICE_TYPE = etree.XPath("ns:invoiceHeader/ns:invoiceType/text()", namespaces=_NS)
+_XP_PAYMENTS = etree.XPath("ns:paymentMethods/ns:paymentMethodDetails", namespaces=_NS)
+_XP_PAYMENT_TYPE = etree.XPath("ns:type/text()", namespaces=_NS)
+_XP_PAYMENT_AMOUNT = etree.XPath("ns:amount/text()", namespaces=_NS)
+_XP_DETAILS = etree.XPath("ns:invoiceDetails", namespaces=_NS)
+_XP_NET_VALUE = etree.XPath("ns:netValue/text()", namespaces=_NS)
+_XP_VAT_AMOUNT = etree.XPath("ns:vatAmount/text()", namespaces=_NS)
+# Line-item total computed inside libxml2's XPath engine: one call replaces
+# the Python loop over invoiceDetails plus a float() per value
+_XP_LINE_TOTAL = etree.XPath(
+    "sum(ns:invoiceDetails/ns:netValue) + sum(ns:invoiceDetails/ns:vatAmount)",
+    namespaces=_NS,
+)
 
 if not USER_ID or not API_KEY:
     print("Error: MYDATA_USER_ID and MYDATA_API_KEY environment variables must be set", file=sys.stderr)
@@ -34,19 +86,157 @@ if not GOOGLE_SPREADSHEET_ID:
     print("Please create a .env file with your credentials (see .env.example)", file=sys.stderr)
     sys.exit(1)
 
+# Shared session so paginated requests reuse pooled TCP/TLS connections and
+# transient connection failures are retried inside urllib3; auth headers are
+# set once. Status-level retries stay with the RateLimiter, which owns the
+# backoff policy.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=3))
+SESSION.headers.update({
+    "aade-user-id": USER_ID,
+    "Ocp-Apim-Subscription-Key": API_KEY,
+    # myDATA pages are large, highly compressible XML; brotli/gzip cut the
+    # bytes on the wire by 5-10x
+    "Accept-Encoding": "br, gzip, deflate",
+})
+
+
+class RateLimiter:
+    """
+    Sliding-window requests-per-minute limiter with AIMD backoff.
+
+    wait() blocks until the one-minute window has room, plus any backoff
+    delay accumulated from throttled responses. On a 429/5xx the delay is
+    doubled (multiplicative increase); each success shaves a bit off again
+    (additive decrease), so throughput settles at what the API sustains.
+    """
+
+    def __init__(self, max_requests_per_minute: int):
+        self.max_rpm = max_requests_per_minute
+        self._timestamps = deque()
+        self._delay = 0.0
+
+    def wait(self):
+        """Block until a request may be issued, then record it."""
+        now = time.monotonic()
+        window = self._timestamps
+        while window and now - window[0] >= 60.0:
+            window.popleft()
+        if len(window) >= self.max_rpm:
+            sleep_for = 60.0 - (now - window[0])
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+        if self._delay:
+            time.sleep(self._delay)
+        self._timestamps.append(time.monotonic())
+
+    def throttled(self, retry_after: Optional[str] = None):
+        """Record a throttled response; honors a Retry-After header if given."""
+        self._delay = min(max(self._delay * 2.0, 1.0), 60.0)
+        if retry_after:
+            try:
+                time.sleep(min(float(retry_after), 120.0))
+            except ValueError:
+                pass
+
+    def succeeded(self):
+        """Record a successful response, easing the backoff delay."""
+        if self._delay:
+            self._delay = max(0.0, self._delay - 0.25)
+
+
+# Proactive throttle for myDATA; generous enough to never bite during a
+# normal run, but it turns a burst of 429s into a paced crawl instead of
+# an aborted one
+RATE_LIMITER = RateLimiter(max_requests_per_minute=60)
+
+# Statuses worth retrying after backing off
+_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+_MAX_FETCH_ATTEMPTS = 3
+
+# Compact per-invoice record: one namedtuple instead of an 8-key dict per
+# invoice, with attribute access downstream and a cheap tuple slice when
+# building sheet rows
+Invoice = namedtuple(
+    "Invoice",
+    "issue_date vat name series aa payment_methods total_amount receiver_vat"
+)
+
+
+# Decimal amounts, including the laxer forms float() accepts (+5, .50, 5.,
+# scientific notation); checking before float() avoids the exception
+# machinery on malformed values in the hot loop without dropping values the
+# builtin would have parsed
+_NUM_RE = re.compile(r"\s*[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?\s*$")
+
+# Invoice types 5/5.1/5.2 are credit notes whose amounts are reversed
+_REVERSE_TYPES = frozenset({"5", "5.1", "5.2"})
+# Payment types that may carry a 0 amount and need the line-item fallback
+_ZERO_AMOUNT_PAYMENT_TYPES = frozenset({"6"})
+
+
+def _text(parent, xp) -> str:
+    """Evaluate a compiled text() XPath and return the stripped first hit, or ""."""
+    result = xp(parent)
+    return result[0].strip() if result else ""
+
+
+# Cheap pre-scan for pagination tokens so the next page request can be issued
+# before the current page is fully parsed (the parser remains authoritative)
+_NEXT_PARTITION_KEY_RE = re.compile(rb"<(?:\w+:)?nextPartitionKey>([^<]+)</")
+_NEXT_ROW_KEY_RE = re.compile(rb"<(?:\w+:)?nextRowKey>([^<]+)</")
+
+# Entity and numeric character references that may appear inside a token;
+# the peek must undo them exactly as the parser would, or an escaped token
+# (legal in Azure Table keys) would be sent back to the API verbatim
+_XML_REF_RE = re.compile(r"&(?:#(\d+)|#x([0-9a-fA-F]+)|(amp|lt|gt|apos|quot));")
+_XML_NAMED_REFS = {"amp": "&", "lt": "<", "gt": ">", "apos": "'", "quot": '"'}
+
+
+def _unescape_xml(text: str) -> str:
+    """Resolve predefined XML entities and character references."""
+    return _XML_REF_RE.sub(
+        lambda m: chr(int(m[1])) if m[1] else (chr(int(m[2], 16)) if m[2] else _XML_NAMED_REFS[m[3]]),
+        text,
+    )
+
+
+
+def _peek_continuation(xml_content: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """Scan the raw XML for continuation tokens without parsing it."""
+    npk = _NEXT_PARTITION_KEY_RE.search(xml_content)
+    nrk = _NEXT_ROW_KEY_RE.search(xml_content)
+    return (
+        _unescape_xml(npk.group(1).decode('utf-8')) if npk else None,
+        _unescape_xml(nrk.group(1).decode('utf-8')) if nrk else None,
+    )
+
+
+_ISO_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})$")
+
+# Comment-to-end-of-line in the VAT numbers file
+_COMMENT_RE = re.compile(r"#.*")
+
 
+@functools.lru_cache(maxsize=64)
 def convert_date_to_api_format(date_str: str) -> str:
     """
     Convert date from YYYY-MM-DD to DD/MM/YYYY format for API.
 
+    A regex field swap instead of strptime/strftime — no datetime object is
+    built just to reformat — and cached, since the same two bounds are
+    re-converted on every paginated request.
+
     Args:
         date_str: Date in YYYY-MM-DD format
 
     Returns:
         Date in DD/MM/YYYY format
     """
-    date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-    return date_obj.strftime("%d/%m/%Y")
+    m = _ISO_DATE_RE.match(date_str)
+    if m is None:
+        raise ValueError(f"Invalid date '{date_str}'. Use YYYY-MM-DD format.")
+    return f"{m[3]}/{m[2]}/{m[1]}"
 
 
 def fetch_invoices(
@@ -55,7 +245,7 @@ def fetch_invoices(
     receiver_vat_number: Optional[str] = None,
     next_partition_key: Optional[str] = None,
     next_row_key: Optional[str] = None
-) -> str:
+) -> bytes:
     """
     Fetch invoices from myDATA API.
 
@@ -67,7 +257,7 @@ def fetch_invoices(
         next_row_key: Pagination key for next row
 
     Returns:
-        XML response as string
+        Raw XML response bytes
     """
     # Convert dates to DD/MM/YYYY format for API
     api_date_from = convert_date_to_api_format(date_from)
@@ -88,29 +278,41 @@ def fetch_invoices(
     if next_row_key:
         params["nextRowKey"] = next_row_key
 
-    headers = {
-        "aade-user-id": USER_ID,
-        "Ocp-Apim-Subscription-Key": API_KEY
-    }
-
-    try:
-        response = requests.get(API_BASE_URL, params=params, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.text
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching data for VAT {receiver_vat_number}: {e}", file=sys.stderr)
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Response text: {e.response.text}", file=sys.stderr)
-        return ""
-
-
-def parse_invoices(xml_content: str, vat_to_name: Optional[Dict[str, str]] = None) -> Tuple[List[Dict], Optional[str], Optional[str]]:
+    for attempt in range(1, _MAX_FETCH_ATTEMPTS + 1):
+        RATE_LIMITER.wait()
+        try:
+            response = SESSION.get(API_BASE_URL, params=params, timeout=30)
+            response.raise_for_status()
+            RATE_LIMITER.succeeded()
+            # Raw bytes: lxml reads the XML encoding declaration itself, so
+            # the full-body str decode response.text would do is never needed
+            return response.content
+        except requests.exceptions.RequestException as e:
+            resp = getattr(e, 'response', None)
+            status = resp.status_code if resp is not None else None
+            if status in _RETRYABLE_STATUSES and attempt < _MAX_FETCH_ATTEMPTS:
+                RATE_LIMITER.throttled(resp.headers.get('Retry-After'))
+                print(f"Retrying after HTTP {status} (attempt {attempt}/{_MAX_FETCH_ATTEMPTS})", file=sys.stderr)
+                continue
+            print(f"Error fetching data for VAT {receiver_vat_number}: {e}", file=sys.stderr)
+            if resp is not None:
+                print(f"Response text: {resp.text}", file=sys.stderr)
+            return b""
+
+
+def parse_invoices(
+    xml_content: bytes,
+    vat_to_name: Optional[Dict[str, str]] = None,
+    vat_filter: Optional[frozenset] = None
+) -> Tuple[List[Invoice], Optional[str], Optional[str]]:
     """
     Parse XML response and extract invoice data.
 
     Args:
-        xml_content: XML response as string
+        xml_content: Raw XML response bytes
         vat_to_name: Optional dictionary mapping VAT numbers to names (used as fallback when name is missing)
+        vat_filter: Optional set of issuer VAT numbers to keep; invoices from
+            other issuers are dropped during the parse instead of afterwards
 
     Returns:
         Tuple of (list of invoice records, next_partition_key, next_row_key)
@@ -121,211 +323,292 @@ def parse_invoices(xml_content: str, vat_to_name: Optional[Dict[str, str]] = Non
     if vat_to_name is None:
         vat_to_name = {}
 
+    # Pagination tokens
+    next_partition_key = None
+    next_row_key = None
+
+    records = []
+
+    # Stream the document invoice-by-invoice instead of building the full DOM;
+    # each processed element is cleared so peak memory stays at one invoice.
+    context = etree.iterparse(
+        BytesIO(xml_content),
+        events=('end',),
+        tag=(TAG_INVOICE, TAG_CONTINUATION_TOKEN),
+        # The XML comes off the network: never expand entities or touch
+        # external resources while parsing it
+        resolve_entities=False,
+        no_network=True,
+    )
+
     try:
-        root = ET.fromstring(xml_content)
-    except ET.ParseError as e:
+        for _event, elem in context:
+            if elem.tag == TAG_CONTINUATION_TOKEN:
+                npk = elem.find(TAG_NEXT_PARTITION_KEY)
+                nrk = elem.find(TAG_NEXT_ROW_KEY)
+                if npk is not None:
+                    next_partition_key = npk.text
+                if nrk is not None:
+                    next_row_key = nrk.text
+            else:
+                record = _extract_invoice_record(elem, vat_to_name, vat_filter)
+                if record is not None:
+                    records.append(record)
+
+            # Free the processed element and any already-parsed siblings
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+    except etree.XMLSyntaxError as e:
         print(f"Error parsing XML: {e}", file=sys.stderr)
         return [], None, None
 
-    # Define namespace
-    ns = {'ns': 'http://www.aade.gr/myDATA/invoice/v1.0'}
+    return records, next_partition_key, next_row_key
 
-    # Extract pagination tokens
-    next_partition_key = None
-    next_row_key = None
 
-    continuation_token = root.find("ns:continuationToken", ns)
-    if continuation_token is not None:
-        npk = continuation_token.find("ns:nextPartitionKey", ns)
-        nrk = continuation_token.find("ns:nextRowKey", ns)
-        if npk is not None:
-            next_partition_key = npk.text
-        if nrk is not None:
-            next_row_key = nrk.text
+def _extract_invoice_record(
+    invoice,
+    vat_to_name: Dict[str, str],
+    vat_filter: Optional[frozenset] = None
+) -> Optional[Invoice]:
+    """
+    Extract one invoice record from a single invoice element.
+    Returns None for invoices without issuer, header, or issue date,
+    and for issuers outside vat_filter (when one is given).
+    """
+    # Invoices without an issuer element are skipped entirely
+    if not _XP_ISSUER(invoice):
+        return None
+
+    issuer_vat = _text(invoice, _XP_ISSUER_VAT)
+
+    # Filter as early as possible: unmatched invoices never materialize
+    if vat_filter is not None and issuer_vat not in vat_filter:
+        return None
+
+    issuer_name = _text(invoice, _XP_ISSUER_NAME)
+
+    # If issuer name is empty or missing, use the name from vat_to_name mapping
+    if not issuer_name and issuer_vat in vat_to_name:
+        issuer_name = vat_to_name[issuer_vat]
+
+    # Get counterpart (receiver) information
+    receiver_vat = _text(invoice, _XP_RECEIVER_VAT)
+
+    # Invoices without a header are skipped entirely
+    if not _XP_INVOICE_HEADER(invoice):
+        return None
+
+    issue_date = _text(invoice, _XP_ISSUE_DATE)
+    series = _text(invoice, _XP_SERIES)
+    aa = _text(invoice, _XP_AA)
+    invoice_type = _text(invoice, _XP_INVOICE_TYPE)
+
+    # Only invoices with a valid issue date produce a record
+    if not issue_date:
+        return None
+
+    # Get payment methods
+    payment_methods_list = []
+    amounts = []
+    needs_line_item_calculation = False
+
+    for payment_detail in _XP_PAYMENTS(invoice):
+        # Get payment type
+        payment_type = _text(payment_detail, _XP_PAYMENT_TYPE)
+        if payment_type:
+            payment_methods_list.append(payment_type)
+
+        # Get payment amount; invalid values count as 0
+        amount_texts = _XP_PAYMENT_AMOUNT(payment_detail)
+        amount = float(amount_texts[0]) if amount_texts and _NUM_RE.match(amount_texts[0]) else 0.0
+
+        # Check if this payment type with 0 amount needs line item calculation
+        if payment_type in _ZERO_AMOUNT_PAYMENT_TYPES and amount == 0.0:
+            needs_line_item_calculation = True
+        else:
+            amounts.append(amount)
+
+    # fsum keeps the total deterministic on invoices with many payments
+    total_amount = math.fsum(amounts)
+
+    # If payment type requires it and amount was 0, calculate from line items.
+    # XPath sum() returns NaN if any value is malformed; only then fall back
+    # to the Python loop that skips the bad values.
+    if needs_line_item_calculation and total_amount == 0.0:
+        total_amount = _XP_LINE_TOTAL(invoice)
+        if math.isnan(total_amount):
+            values = []
+            for invoice_detail in _XP_DETAILS(invoice):
+                values.extend(_XP_NET_VALUE(invoice_detail))
+                values.extend(_XP_VAT_AMOUNT(invoice_detail))
+            total_amount = math.fsum(float(t) for t in values if _NUM_RE.match(t))
+
+    # Create payment methods comma-separated string
+    payment_methods_str = ", ".join(payment_methods_list) if payment_methods_list else ""
+
+    # Reverse amount for invoice types 5.1 and 5.2
+    if invoice_type in _REVERSE_TYPES:
+        total_amount = -total_amount
+
+    return Invoice(
+        issue_date=issue_date,
+        vat=issuer_vat,
+        name=issuer_name,
+        series=series,
+        aa=aa,
+        payment_methods=payment_methods_str,
+        total_amount=total_amount,
+        receiver_vat=receiver_vat
+    )
 
-    # Extract invoice data
-    records = []
-    # Find invoicesDoc container first
-    invoices_doc = root.find("ns:invoicesDoc", ns)
-    if invoices_doc is None:
-        return records, next_partition_key, next_row_key
-
-    invoices = invoices_doc.findall("ns:invoice", ns)
-
-    for invoice in invoices:
-        # Get issuer information
-        issuer = invoice.find("ns:issuer", ns)
-        if issuer is None:
-            continue
-
-        issuer_vat_elem = issuer.find("ns:vatNumber", ns)
-        issuer_name_elem = issuer.find("ns:name", ns)
-
-        issuer_vat = issuer_vat_elem.text.strip() if issuer_vat_elem is not None and issuer_vat_elem.text else ""
-        issuer_name = issuer_name_elem.text.strip() if issuer_name_elem is not None and issuer_name_elem.text else ""
-
-        # If issuer name is empty or missing, use the name from vat_to_name mapping
-        if not issuer_name and issuer_vat in vat_to_name:
-            issuer_name = vat_to_name[issuer_vat]
-
-        # Get counterpart (receiver) information
-        counterpart = invoice.find("ns:counterpart", ns)
-        receiver_vat = ""
-        if counterpart is not None:
-            receiver_vat_elem = counterpart.find("ns:vatNumber", ns)
-            receiver_vat = receiver_vat_elem.text.strip() if receiver_vat_elem is not None and receiver_vat_elem.text else ""
-
-        # Get invoice header
-        invoice_header = invoice.find("ns:invoiceHeader", ns)
-        if invoice_header is None:
-            continue
-
-        issue_date_elem = invoice_header.find("ns:issueDate", ns)
-        series_elem = invoice_header.find("ns:series", ns)
-        aa_elem = invoice_header.find("ns:aa", ns)
-        invoice_type_elem = invoice_header.find("ns:invoiceType", ns)
-
-        issue_date = issue_date_elem.text.strip() if issue_date_elem is not None and issue_date_elem.text else ""
-        series = series_elem.text.strip() if series_elem is not None and series_elem.text else ""
-        aa = aa_elem.text.strip() if aa_elem is not None and aa_elem.text else ""
-        invoice_type = invoice_type_elem.text.strip() if invoice_type_elem is not None and invoice_type_elem.text else ""
-
-        # Get payment methods
-        payment_methods_list = []
-        total_amount = 0.0
-        # Payment types that may have 0 amount and require calculating from line items
-        zero_amount_payment_types = {"6"}
-        needs_line_item_calculation = False
-
-        payment_methods = invoice.find("ns:paymentMethods", ns)
-        if payment_methods is not None:
-            for payment_detail in payment_methods.findall("ns:paymentMethodDetails", ns):
-                # Get payment type
-                payment_type_elem = payment_detail.find("ns:type", ns)
-                payment_type = ""
-                if payment_type_elem is not None and payment_type_elem.text:
-                    payment_type = payment_type_elem.text.strip()
-                    payment_methods_list.append(payment_type)
-
-                # Get payment amount
-                amount_elem = payment_detail.find("ns:amount", ns)
-                amount = 0.0
-                if amount_elem is not None and amount_elem.text:
-                    try:
-                        amount = float(amount_elem.text)
-                    except ValueError:
-                        pass
-
-                # Check if this payment type with 0 amount needs line item calculation
-                if payment_type in zero_amount_payment_types and amount == 0.0:
-                    needs_line_item_calculation = True
-                else:
-                    total_amount += amount
-
-        # If payment type requires it and amount was 0, calculate from line items
-        if needs_line_item_calculation and total_amount == 0.0:
-            for invoice_detail in invoice.findall("ns:invoiceDetails", ns):
-                net_value_elem = invoice_detail.find("ns:netValue", ns)
-                vat_amount_elem = invoice_detail.find("ns:vatAmount", ns)
-
-                if net_value_elem is not None and net_value_elem.text:
-                    try:
-                        total_amount += float(net_value_elem.text)
-                    except ValueError:
-                        pass
-
-                if vat_amount_elem is not None and vat_amount_elem.text:
-                    try:
-                        total_amount += float(vat_amount_elem.text)
-                    except ValueError:
-                        pass
-
-        # Create payment methods comma-separated string
-        payment_methods_str = ", ".join(payment_methods_list) if payment_methods_list else ""
-
-        # Reverse amount for invoice types 5.1 and 5.2
-        if invoice_type in ["5", "5.1", "5.2"]:
-            total_amount = -total_amount
-
-        # Only add records with valid issue date
-        if issue_date:
-            records.append({
-                "issue_date": issue_date,
-                "vat": issuer_vat,
-                "name": issuer_name,
-                "series": series,
-                "aa": aa,
-                "payment_methods": payment_methods_str,
-                "total_amount": total_amount,
-                "receiver_vat": receiver_vat
-            })
 
-    return records, next_partition_key, next_row_key
+def _iter_spooled_records(path: str) -> Iterator[Invoice]:
+    """Stream Invoice records back from an NDJSON spool file, deleting it at the end."""
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                yield Invoice(*orjson.loads(line))
+    finally:
+        os.unlink(path)
 
 
-def fetch_all_invoices(date_from: str, date_to: str, vat_to_name: Optional[Dict[str, str]] = None) -> List[Dict]:
+def fetch_all_invoices(
+    date_from: str,
+    date_to: str,
+    vat_to_name: Optional[Dict[str, str]] = None
+) -> Tuple[Iterator[Invoice], int]:
     """
     Fetch all invoices for a date range and optionally filter by VAT numbers locally.
 
+    Parsed records are spooled to a temporary NDJSON file as pages arrive
+    instead of accumulating in memory, so peak RSS stays flat on multi-month
+    runs; the caller gets them back as a lazy iterator.
+
     Args:
         date_from: Start date in YYYY-MM-DD format
         date_to: End date in YYYY-MM-DD format
         vat_to_name: Optional dictionary mapping VAT numbers to names. If None or empty, no filtering is applied.
 
     Returns:
-        List of invoice records (filtered if vat_to_name is provided)
+        Tuple of (iterator over invoice records, record count); filtered if
+        vat_to_name is provided. The iterator deletes the spool file once
+        exhausted.
     """
-    # Get VAT numbers as a set for faster lookup
-    vat_set = set(vat_to_name.keys()) if vat_to_name else set()
+    # VAT allowlist as a frozenset; applied during the parse so unmatched
+    # invoices are never materialized as records
+    vat_filter = frozenset(vat_to_name) if vat_to_name else None
 
     print(f"Fetching all invoices for date range (single API call)")
-    if vat_set:
-        print(f"Will filter results for {len(vat_set)} VAT number(s)")
+    if vat_filter:
+        print(f"Will filter results for {len(vat_filter)} VAT number(s)")
     else:
         print("No VAT filter specified - returning all invoices")
 
-    all_records = []
-    next_partition_key = None
-    next_row_key = None
+    spool = tempfile.NamedTemporaryFile(suffix='.ndjson', delete=False)
+    total_records = 0
     page = 1
 
-    # Fetch all invoices without VAT filter
-    while True:
+    # Producer/consumer pipeline: a fetch thread follows the continuation
+    # tokens (peeked off the raw bytes) and feeds pages through a bounded
+    # queue, so page N+1 downloads while page N parses. The queue bound
+    # keeps at most two undecoded pages in memory.
+    page_queue: Queue = Queue(maxsize=2)
+    _sentinel = object()
+    stop_producing = threading.Event()
+
+    def _produce():
+        npk = nrk = None
+        try:
+            while not stop_producing.is_set():
+                xml_content = fetch_invoices(
+                    date_from, date_to,
+                    next_partition_key=npk, next_row_key=nrk
+                )
+                page_queue.put(xml_content)
+                if not xml_content:
+                    break
+                npk, nrk = _peek_continuation(xml_content)
+                if not npk or not nrk:
+                    break
+        finally:
+            page_queue.put(_sentinel)
+
+    next_partition_key = next_row_key = None
+    peek_missed_tokens = False
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        producer = executor.submit(_produce)
+
+        try:
+            while True:
+                xml_content = page_queue.get()
+                if xml_content is _sentinel:
+                    break
+                if not xml_content:
+                    continue
+
+                records, next_partition_key, next_row_key = parse_invoices(
+                    xml_content, vat_to_name, vat_filter
+                )
+                spool.writelines(orjson.dumps(list(r)) + b'\n' for r in records)
+                total_records += len(records)
+
+                # The producer paginates on the raw-bytes peek; remember whether
+                # the parser's authoritative tokens disagreed (missed *or*
+                # mangled by the peek) so pagination can resume from them
+                peek_npk, peek_nrk = _peek_continuation(xml_content)
+                peek_missed_tokens = bool(
+                    next_partition_key and next_row_key
+                    and (peek_npk, peek_nrk) != (next_partition_key, next_row_key)
+                )
+
+                print(f"  Page {page}: Fetched {len(records)} invoice(s)")
+                page += 1
+        except BaseException:
+            # Unblock a producer stuck on the full queue and drain until its
+            # sentinel arrives, so the executor shutdown cannot hang the
+            # process on the way out
+            stop_producing.set()
+            while page_queue.get() is not _sentinel:
+                pass
+            raise
+
+        # Surface producer-side failures; dropping the future would turn
+        # them into a silent "0 invoices fetched" run
+        producer.result()
+
+    # Safety net: serially follow any tokens the peek failed to spot
+    while peek_missed_tokens and next_partition_key and next_row_key:
         xml_content = fetch_invoices(
             date_from, date_to,
-            receiver_vat_number=None,  # No VAT filter in API call
             next_partition_key=next_partition_key,
             next_row_key=next_row_key
         )
-
         if not xml_content:
             break
-
-        records, next_partition_key, next_row_key = parse_invoices(xml_content, vat_to_name)
-        all_records.extend(records)
-
+        records, next_partition_key, next_row_key = parse_invoices(
+            xml_content, vat_to_name, vat_filter
+        )
+        spool.writelines(orjson.dumps(list(r)) + b'\n' for r in records)
+        total_records += len(records)
         print(f"  Page {page}: Fetched {len(records)} invoice(s)")
         page += 1
 
-        # If no pagination tokens, we're done
-        if not next_partition_key or not next_row_key:
-            break
-
-    print(f"\nTotal invoices fetched: {len(all_records)}")
-
-    # Skip filtering if no VAT numbers provided
-    if not vat_set:
-        return all_records
+    spool.close()
 
-    # Filter records by issuer VAT numbers
-    filtered_records = [
-        record for record in all_records
-        if record.get("vat", "").strip() in vat_set
-    ]
+    if vat_filter:
+        print(f"\nTotal invoices matching the VAT numbers: {total_records}")
+    else:
+        print(f"\nTotal invoices fetched: {total_records}")
 
-    print(f"Filtered to {len(filtered_records)} invoice(s) matching the VAT numbers")
+    if total_records == 0:
+        os.unlink(spool.name)
+        return iter(()), 0
 
-    return filtered_records
+    return _iter_spooled_records(spool.name), total_records
 
 
 def read_vat_numbers(filename: str) -> Dict[str, str]:
@@ -343,20 +626,17 @@ def read_vat_numbers(filename: str) -> Dict[str, str]:
     """
     try:
         with open(filename, 'r', encoding='utf-8') as f:
-            vat_to_name = {}
-            for line in f:
-                # Remove comments (anything after #)
-                line = line.split('#')[0].strip()
-                # Skip empty lines
-                if not line:
-                    continue
-                # Split into VAT number and name (first whitespace-separated token is VAT, rest is name)
-                parts = line.split(None, 1)  # Split on whitespace, max 2 parts
-                if parts:
-                    vat_number = parts[0].strip()
-                    name = parts[1].strip() if len(parts) > 1 else ""
-                    vat_to_name[vat_number] = name
-            return vat_to_name
+            text = f.read()
+
+        # Strip all comments in one regex pass over the whole buffer, then
+        # split; whitespace-splitting makes the per-line strip() calls moot
+        vat_to_name = {}
+        for line in _COMMENT_RE.sub('', text).splitlines():
+            # First whitespace-separated token is VAT, rest is name
+            parts = line.split(None, 1)
+            if parts:
+                vat_to_name[parts[0]] = parts[1].strip() if len(parts) > 1 else ""
+        return vat_to_name
     except FileNotFoundError:
         print(f"Error: File '{filename}' not found", file=sys.stderr)
         sys.exit(1)
@@ -367,10 +647,12 @@ def read_vat_numbers(filename: str) -> Dict[str, str]:
 
 def get_google_sheets_service():
     """
-    Create and return Google Sheets API service.
+    Create and return Google Sheets API service and its credentials.
 
     Returns:
-        Google Sheets API service object
+        Tuple of (Google Sheets API service object, credentials); the
+        credentials are used to authorize direct REST calls that bypass
+        the discovery client.
     """
     try:
         credentials = service_account.Credentials.from_service_account_file(
@@ -378,7 +660,7 @@ def get_google_sheets_service():
             scopes=['https://www.googleapis.com/auth/spreadsheets']
         )
         service = build('sheets', 'v4', credentials=credentials)
-        return service
+        return service, credentials
     except FileNotFoundError:
         print(f"Error: Google credentials file '{GOOGLE_CREDENTIALS_FILE}' not found", file=sys.stderr)
         print("Please create a service account in Google Cloud Console and download the JSON file", file=sys.stderr)
@@ -388,92 +670,267 @@ def get_google_sheets_service():
         sys.exit(1)
 
 
-def append_to_google_sheets(service, records: List[Dict], sheet_name: str = "Sheet1"):
+def append_to_google_sheets(service, credentials, records: Iterable[Invoice], sheet_name: str = "Sheet1"):
     """
     Append invoice records to Google Sheets.
     Only appends records if the combination of columns 4 & 5 (series + aa) doesn't already exist.
 
+    Consumes records as a stream in chunk-sized batches (they may come off
+    the fetch spool), so peak memory is bounded by the chunk size rather
+    than the total record count.
+
     Args:
-        service: Google Sheets API service
-        records: List of invoice records
+        service: Google Sheets API service (used for the dedup read)
+        credentials: Service-account credentials for the direct append POST
+        records: Iterable of invoice records
         sheet_name: Name of the sheet to append to
     """
-    if not records:
-        print("No records to append")
-        return
-
+    conn = _open_seen_db()
+    wm_key = f"watermark:{sheet_name}"
     try:
-        # Read existing data from the sheet to check for duplicates
-        existing_data = service.spreadsheets().values().get(
-            spreadsheetId=GOOGLE_SPREADSHEET_ID,
-            range=f"{sheet_name}!A:G"
-        ).execute()
-
-        existing_rows = existing_data.get('values', [])
-
-        # Create a set of composite keys (series + aa) from existing data
-        # Columns 4 & 5 are indices 3 & 4 in the array (0-indexed)
-        existing_keys = set()
-        for row in existing_rows:
-            if len(row) >= 5:  # Ensure row has at least 5 columns
-                series = row[3] if len(row) > 3 else ""
-                aa = row[4] if len(row) > 4 else ""
-                composite_key = f"{series}|{aa}"
-                existing_keys.add(composite_key)
-
-        print(f"Found {len(existing_keys)} existing record(s) in spreadsheet")
-
-        # Filter out records that already exist
-        new_rows = []
+        # Local cache first: keys already appended by a previous run are
+        # skipped without touching the spreadsheet at all
+        cached_keys = set(conn.execute("SELECT series, aa FROM seen"))
+        if cached_keys:
+            print(f"Found {len(cached_keys)} known record(s) in the local cache")
+
+        existing_keys = None  # fetched lazily, on the first locally-unknown key
+        scanned_rows = 0
+        seen_in_batch = set()
+        batch_rows: List[List] = []
+        batch_keys: List[Tuple[str, str]] = []
+        total_records = 0
+        total_updated = 0
         skipped_count = 0
+        chunk_size = _APPEND_CHUNK_ROWS
+        attempts = 0
+        flushes = 0
+
+        def _flush():
+            """Append the buffered batch, then fold its keys into the cache.
+
+            Appends via the REST endpoint directly: orjson serializes the
+            body in C instead of httplib2's pure-Python json pass through
+            the discovery client. The chunk size halves when the write quota
+            pushes back and creeps back up on success, and the cache commit
+            after each batch means a crash mid-run cannot re-append rows the
+            sheet already has.
+            """
+            nonlocal total_updated, chunk_size, attempts, flushes
+            i = 0
+            while i < len(batch_rows):
+                chunk = batch_rows[i:i + chunk_size]
+                try:
+                    result = _append_values(credentials, sheet_name, chunk)
+                except requests.exceptions.HTTPError as e:
+                    resp = e.response
+                    status = resp.status_code if resp is not None else None
+                    if status in _RETRYABLE_STATUSES and attempts < _MAX_SHEETS_TRIES - 1:
+                        if status == 429 and chunk_size > 1:
+                            chunk_size = max(1, chunk_size // 2)
+                        _sheets_backoff(attempts, resp.headers.get('Retry-After'))
+                        attempts += 1
+                        continue
+                    raise
+                attempts = 0
+                total_updated += result.get('updates', {}).get('updatedRows', 0)
+                i += len(chunk)
+                chunk_size = min(_APPEND_CHUNK_ROWS, chunk_size + _APPEND_CHUNK_STEP)
+            flushes += 1
+            # Progress only when the append actually spans batches
+            if flushes > 1 or len(batch_rows) >= _APPEND_CHUNK_ROWS:
+                print(f"  Appended {total_updated} row(s) so far")
+            conn.executemany("INSERT OR IGNORE INTO seen VALUES (?, ?)", batch_keys)
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                (wm_key, scanned_rows + total_updated)
+            )
+            conn.commit()
+            batch_rows.clear()
+            batch_keys.clear()
+
         for record in records:
-            series = str(record["series"]) if record["series"] else ""
-            aa = str(record["aa"]) if record["aa"] else ""
-            composite_key = f"{series}|{aa}"
-
-            if composite_key not in existing_keys:
-                new_rows.append([
-                    record["issue_date"],
-                    record["vat"],
-                    record["name"],
-                    record["series"],
-                    record["aa"],
-                    record["payment_methods"],
-                    record["total_amount"]
-                ])
-            else:
+            total_records += 1
+            # series/aa come out of parse_invoices as plain strings
+            key = (record.series, record.aa)
+            if key in cached_keys or key in seen_in_batch:
+                skipped_count += 1
+                continue
+            if existing_keys is None:
+                existing_keys, scanned_rows = _load_existing_keys(service, conn, sheet_name)
+                # Cache the sheet keys and the rows they cover before any
+                # flush can advance the watermark: if the run dies
+                # mid-append, the next one only reads past the watermark and
+                # must already know every key beneath it
+                conn.executemany("INSERT OR IGNORE INTO seen VALUES (?, ?)", existing_keys)
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                    (wm_key, scanned_rows)
+                )
+                conn.commit()
+            if key in existing_keys:
                 skipped_count += 1
+                continue
+            seen_in_batch.add(key)
+            # First seven fields, in sheet column order
+            batch_rows.append(list(record[:7]))
+            batch_keys.append(key)
+            if len(batch_rows) >= _APPEND_CHUNK_ROWS:
+                _flush()
+
+        if batch_rows:
+            _flush()
+
+        if total_records == 0:
+            print("No records to append")
+            return
 
         if skipped_count > 0:
             print(f"Skipped {skipped_count} duplicate record(s)")
 
-        if not new_rows:
+        if total_updated == 0:
             print("No new records to append (all records already exist)")
-            return
-
-        # Append only new data to sheet
-        body = {
-            'values': new_rows
-        }
-        result = service.spreadsheets().values().append(
-            spreadsheetId=GOOGLE_SPREADSHEET_ID,
-            range=f"{sheet_name}!A:G",
-            valueInputOption='RAW',
-            insertDataOption='INSERT_ROWS',
-            body=body
-        ).execute()
-
-        updates = result.get('updates', {})
-        updated_rows = updates.get('updatedRows', 0)
-        print(f"\nSuccessfully appended {updated_rows} new row(s) to Google Sheets")
+        else:
+            print(f"\nSuccessfully appended {total_updated} new row(s) to Google Sheets")
 
     except HttpError as e:
         print(f"Error accessing Google Sheets: {e}", file=sys.stderr)
         sys.exit(1)
+    except requests.exceptions.RequestException as e:
+        print(f"Error appending to Google Sheets: {e}", file=sys.stderr)
+        if getattr(e, 'response', None) is not None:
+            print(f"Response text: {e.response.text}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+def _load_existing_keys(service, conn, sheet_name: str) -> Tuple[set, int]:
+    """
+    Read the (series, aa) keys for sheet rows past the cached watermark.
+
+    Reads only the two key columns (D = series, E = aa) instead of the whole
+    A:G range; COLUMNS orientation gives the keys as two parallel lists, so
+    the dedup set is one zip away. This is the safety check for keys the
+    local cache does not know about; the watermark records how many sheet
+    rows previous runs have already folded into the cache, so only rows past
+    it are fetched. Tuple keys hash the two strings directly instead of
+    formatting a delimited string per row, and cannot collide on the
+    delimiter.
+
+    Returns:
+        Tuple of (set of key tuples, total sheet rows now accounted for)
+    """
+    wm_row = conn.execute(
+        "SELECT value FROM meta WHERE key = ?", (f"watermark:{sheet_name}",)
+    ).fetchone()
+    start_row = (wm_row[0] if wm_row else 0) + 1
+    existing_data = _exec_with_retry(service.spreadsheets().values().batchGet(
+        spreadsheetId=GOOGLE_SPREADSHEET_ID,
+        ranges=[f"{sheet_name}!D{start_row}:E"],
+        majorDimension="COLUMNS"
+    ))
+
+    value_ranges = existing_data.get('valueRanges', [])
+    columns = value_ranges[0].get('values', []) if value_ranges else []
+    series_col = columns[0] if len(columns) > 0 else []
+    aa_col = columns[1] if len(columns) > 1 else []
+
+    existing_keys = set(zip(series_col, aa_col))
+    print(f"Found {len(existing_keys)} existing record(s) in spreadsheet")
+    return existing_keys, start_row - 1 + max(len(series_col), len(aa_col))
+
+
+# Bound on attempts per Sheets request (reads and append chunks alike)
+_MAX_SHEETS_TRIES = 6
+
+
+def _sheets_backoff(attempt: int, retry_after: Optional[str] = None):
+    """Sleep before retrying a throttled Sheets call.
+
+    Honors a Retry-After header when given, otherwise jittered exponential
+    backoff capped at a minute.
+    """
+    if retry_after:
+        try:
+            time.sleep(min(float(retry_after), 120.0))
+            return
+        except ValueError:
+            pass
+    time.sleep(min(2 ** attempt + random.random(), 60.0))
+
+
+def _exec_with_retry(request, max_tries: int = _MAX_SHEETS_TRIES):
+    """Execute a googleapiclient request, retrying transient 429/5xx errors.
+
+    A quota blip on the dedup read would otherwise abort the run and throw
+    away everything already fetched from myDATA.
+    """
+    for attempt in range(max_tries):
+        try:
+            return request.execute()
+        except HttpError as e:
+            status = getattr(e.resp, 'status', None)
+            if status in _RETRYABLE_STATUSES and attempt < max_tries - 1:
+                print(f"Sheets API returned {status}, retrying", file=sys.stderr)
+                _sheets_backoff(attempt)
+                continue
+            raise
+
+
+def _open_seen_db() -> sqlite3.Connection:
+    """Open (creating if needed) the local cache of appended (series, aa) keys."""
+    conn = sqlite3.connect(DEDUP_DB_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS seen ("
+        "series TEXT NOT NULL, aa TEXT NOT NULL, PRIMARY KEY (series, aa))"
+    )
+    # Bookkeeping such as the per-sheet row watermark
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+    )
+    return conn
+
+
+# Append batching: start at 5000 rows per POST, halve on 429 (multiplicative
+# decrease), grow back by 500 rows per successful chunk (additive increase)
+_APPEND_CHUNK_ROWS = 5000
+_APPEND_CHUNK_STEP = 500
+
+
+def _append_values(credentials, sheet_name: str, rows: List[List]) -> Dict:
+    """POST rows to the Sheets values.append REST endpoint."""
+    if not credentials.valid:
+        credentials.refresh(GoogleAuthRequest())
+
+    url = (
+        "https://sheets.googleapis.com/v4/spreadsheets/"
+        f"{GOOGLE_SPREADSHEET_ID}/values/{quote(f'{sheet_name}!A:G')}:append"
+    )
+    response = requests.post(
+        url,
+        params={'valueInputOption': 'RAW', 'insertDataOption': 'INSERT_ROWS'},
+        headers={
+            'Authorization': f"Bearer {credentials.token}",
+            'Content-Type': 'application/json',
+        },
+        data=orjson.dumps({'values': rows}),
+        timeout=60,
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content)
 
 
 def validate_date(date_str: str) -> bool:
-    """Validate date format (YYYY-MM-DD)."""
+    """
+    Validate date format (YYYY-MM-DD, zero-padded) and calendar validity.
+
+    The regex gate matches what convert_date_to_api_format accepts: strptime
+    alone would pass unpadded dates like 2025-1-1 that the converter later
+    rejects deep inside the fetch pipeline.
+    """
+    if not _ISO_DATE_RE.match(date_str):
+        return False
     try:
         datetime.strptime(date_str, "%Y-%m-%d")
         return True
@@ -554,20 +1011,20 @@ def main():
 
     print(f"Date range: {date_from} to {date_to}\n")
 
-    # Fetch all invoices
-    records = fetch_all_invoices(date_from, date_to, vat_to_name)
+    # Fetch all invoices; records stream back from the on-disk spool
+    records, record_count = fetch_all_invoices(date_from, date_to, vat_to_name)
 
-    if not records:
+    if not record_count:
         print("\nNo invoice data found")
         sys.exit(0)
 
-    print(f"\nTotal invoices fetched: {len(records)}")
+    print(f"\nTotal invoices fetched: {record_count}")
 
     # Get Google Sheets service
-    sheets_service = get_google_sheets_service()
+    sheets_service, credentials = get_google_sheets_service()
 
     # Append to Google Sheets
-    append_to_google_sheets(sheets_service, records, args.sheet_name)
+    append_to_google_sheets(sheets_service, credentials, records, args.sheet_name)
 
     print("\nDone!")
 